@@ -0,0 +1,86 @@
+"""CSC111 Winter 2021 Project: Sudoku Solver
+
+This module computes the screen geometry of the cages in a Killer Sudoku. The
+boundary segments of a cage are pure integer arithmetic on the cage's coordinates,
+so they live in this separate module that is free of any pyglet objects: the
+interface only turns the returned endpoint tuples into Line shapes. Keeping the
+loop down to integers and set lookups also leaves it ready to be compiled with
+Cython should the cage drawing ever need more speed.
+
+Cells are identified by the flat integer key produced by cell_key, so the
+adjacency probes are integer additions and set lookups of plain ints rather
+than allocating and hashing a coordinate tuple per probe.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright (c) 2021 Raymond Liu
+"""
+
+# The side length of a cell on screen never changes, so it is folded into the
+# segment arithmetic below as a constant, and the screen corner of each cell
+# column and row is precomputed.
+CELL = 60
+_CX = tuple(20 + x * CELL for x in range(10))
+_CY = tuple(620 - y * CELL for y in range(10))
+
+
+def cell_key(x: int, y: int) -> int:
+    """Return the flat integer key (y << 4) | x of the cell at (x, y).
+
+    The neighbouring cell on the left/right differs from the key by 1, and the
+    neighbouring cell above/below differs from the key by 16.
+
+    Preconditions:
+        - 1 <= x <= 9 and 1 <= y <= 9
+    """
+    return (y << 4) | x
+
+
+def build_cage_lines(coords: frozenset[int]) -> list[tuple[int, int, int, int]]:
+    """Return the endpoints (lx1, ly1, lx2, ly2) of every boundary segment of the cage
+    whose cells have the given cell_key keys.
+
+    A segment is emitted on a side of a cell when the adjacent cell on that side is not
+    in the same cage. A cell's four adjacency lookups fix all four candidate segments at
+    once: the vertical segments share their endpoints (extended by 5 pixels towards an
+    adjacent cage cell, shortened by 5 otherwise), as do the horizontal ones.
+
+    Preconditions:
+        - all(1 <= k & 15 <= 9 and 1 <= k >> 4 <= 9 for k in coords)
+    """
+    lines = []
+    for k in coords:
+        cx, cy = _CX[k & 15], _CY[k >> 4]
+        up = k - 16 in coords
+        down = k + 16 in coords
+        left = k - 1 in coords
+        right = k + 1 in coords
+
+        ly1 = cy - 5 if down else cy + 5
+        ly2 = cy + CELL + 5 if up else cy + CELL - 5
+        lx1 = cx - 5 if left else cx + 5
+        lx2 = cx + CELL + 5 if right else cx + CELL - 5
+
+        if not right:
+            lines.append((cx + CELL - 5, ly1, cx + CELL - 5, ly2))
+        if not left:
+            lines.append((cx + 5, ly1, cx + 5, ly2))
+        if not down:
+            lines.append((lx1, cy + 5, lx2, cy + 5))
+        if not up:
+            lines.append((lx1, cy + CELL - 5, lx2, cy + CELL - 5))
+    return lines
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    python_ta.check_all(config={
+        'extra-imports': [],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136'],
+        'max-nested-blocks': 4,
+    })
@@ -7,14 +7,46 @@ Copyright and Usage Information
 
 This file is Copyright (c) 2021 Raymond Liu
 """
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import pyglet
+from pyglet.gl import GL_LINES, glLineWidth
 from pyglet.shapes import Line, Rectangle
 from pyglet.text import Label
 from pyglet.window import key
 from pyglet import clock
+from cage_geom import build_cage_lines, cell_key
+from solver_core import solve_grid
 from sudoku import ClassicSudoku, _ClaVertex, Optional, KillerSudoku, _KilVertex, Cage, \
     IndirectCage, Union
 
+# Entry values are 1-9 and cage sums never exceed 45, so the label strings and
+# their lengths can be looked up instead of recomputed with str() on every redraw.
+_DIGIT = tuple(str(i) for i in range(46))
+_DIGIT_LEN = tuple(len(digit) for digit in _DIGIT)
+
+# Screen coordinates only ever depend on a 1-9 cell coordinate, so the label
+# centres and the cage-sum corners are precomputed instead of recomputed per cell.
+_CX_LABEL = tuple(50 + 60 * x for x in range(10))
+_CY_LABEL = tuple(650 - 60 * y for y in range(10))
+_CX_CAGE_SUM = tuple(20 + 60 * x for x in range(10))
+_CY_CAGE_SUM = tuple(680 - 60 * y for y in range(10))
+
+# Width of each of the ten grid lines: every third line is a thick subgrid border.
+_OUTLINE_WIDTHS = (4, 2, 2, 4, 2, 2, 4, 2, 2, 4)
+
+
+class _ThinLineGroup(pyglet.graphics.Group):
+    """A graphics group that draws its vertex list with 2-pixel-wide GL lines."""
+
+    def set_state(self) -> None:
+        """Set the GL line width used by the thin outline lines."""
+        glLineWidth(2)
+
+    def unset_state(self) -> None:
+        """Restore the default GL line width."""
+        glLineWidth(1)
+
 
 class SudokuWindow(pyglet.window.Window):
     """A user interactive window for Sudoku solvers.
@@ -26,22 +58,54 @@ class SudokuWindow(pyglet.window.Window):
         - sudoku: an instance of Sudoku that is currently being displayed and solved.
         - batch: an instance of pyglet.graphics.Batch() that can draw multiple pyglet.shapes
         objects and pyglet.text at once to improve drawing speed.
-        - outlines: a list of Line objects for the outline of the Sudoku puzzle.
-        - numbers: a dictionary that maps the coordinate of an entry (e.g. (1, 1), (9, 9) )
-        to the Label object of that entry.
-        - cage_lines: a list of Line and Label objects for the cage lines of a Killer Sudoku.
+        - outlines: a list of Line objects for the thick outline of the Sudoku puzzle.
+        - _outline_vlist: a single vertex list holding the twelve thin grid lines, so
+        the static grid is drawn in one call instead of one per Line shape.
+        - numbers: a dictionary that maps the cell_key key of an entry to the persistent
+        Label object of that entry. The labels are created once and their text/colour
+        are mutated afterwards, as rebuilding a Label re-runs the expensive glyph layout.
+        - _last_rendered: a dictionary that maps the cell_key key of an entry to the
+        value its label currently displays, used to skip the labels that have not
+        changed.
+        - cage_lines: a list of the Line and Label objects currently displaying the
+        cages of a Killer Sudoku.
+        - _cage_line_pool: hidden cage Line objects kept in the batch for reuse, so
+        redrawing cages updates pooled vertex lists instead of deleting and
+        recreating shapes.
+        - _cage_label_pool: hidden cage-sum Label objects kept for the same reason.
         - buttons: a list of Line and Label objects for the buttons in the window.
         - button_info: a list of 4-tuples, each containing the screen coordinate as well as
         the width and height of a button.
+        - button_names: a list of the names of the buttons, in the same order as
+        button_info.
         - cell_side: the length of a cell on screen.
-        - track_mouse: a Rectangle object that appears when the users hover their mouse onto
-        a cell or a button, and disappear (get deleted) otherwise.
-        - invalid_msg: a Label object that displays the message "Invalid Input!" to the user
-        when they made an invalid input to a cell.
-        - error_msg: a Label object that displays the message "Puzzle Unsolvable" to the user
-        when the current Sudoku puzzle is unsolvable.
-        - fade: an integer that influences the color of the two messages so that they fade
-        after 1 second or so.
+        - track_mouse: a single reusable Rectangle that highlights the cell or button
+        under the mouse; it is moved and resized in place, and made transparent when
+        the mouse is not on a cell or a button.
+        - _button_rects: a list of 5-tuples (left, right, bottom, top, name) precomputed
+        from button_info for the hit tests in on_button.
+        - _hover_key: the key of the cell or button the mouse is currently on, used to
+        skip the mouse-motion work when the hovered target has not changed.
+        - _px_to_cx: a lookup table that maps the x pixel coordinate of the mouse to the
+        x coordinate of the cell below it, or 0 when the pixel is outside the grid.
+        - _py_to_cy: the same lookup table for the y pixel coordinate of the mouse.
+        - _cell_origin: a dictionary that maps the cell_key key of a cell to the screen
+        coordinate of its bottom-left corner.
+        - status_msg: a single Label object that displays either "Invalid Input!" or
+        "Puzzle Unsolvable!" to the user; the two messages are mutually exclusive, so
+        they share one label and only its text changes.
+        - _fading: whether status_msg is currently fading out.
+        - _fade_elapsed: the time in seconds since the current fade started.
+        - _fade_alpha: the alpha value last written to the fading label, used to skip
+        the colour write (which touches the batch) when the alpha has not changed.
+        - _executor: a single-worker thread pool that runs the solver off the event
+        loop thread, so the window stays responsive during a long solve.
+        - _solve_future: the Future of the solve currently running in _executor, or
+        None when no solve is in progress. Button and key input is ignored while a
+        solve is pending so the puzzle cannot change under the solver.
+        - _dirty: the number of upcoming frames that must be redrawn. It is set to 2
+        whenever the scene changes (once per swap buffer) and counts down to 0, at
+        which point on_draw stops re-submitting the unchanged batch.
         - mx: the x coordinate of the mouse.
         - my: the y coordinate of the mouse.
     """
@@ -50,15 +114,29 @@ class SudokuWindow(pyglet.window.Window):
     sudoku: Union[ClassicSudoku, KillerSudoku]
     batch: pyglet.graphics.Batch
     outlines: list[Line]
-    numbers: dict[tuple[int, int], Label]
+    _outline_vlist: pyglet.graphics.vertexdomain.VertexList
+    numbers: dict[int, Label]
+    _last_rendered: dict[int, Optional[int]]
     cage_lines: list[Union[Line, Label]]
+    _cage_line_pool: list[Line]
+    _cage_label_pool: list[Label]
     buttons: list[Union[Line, Label]]
     button_info: list[tuple[int, int, int, int]]
+    button_names: list[str]
     cell_side: int
-    track_mouse: Optional[Rectangle]
-    invalid_msg: Label
-    error_msg: Label
-    fade: int
+    track_mouse: Rectangle
+    _button_rects: list[tuple[int, int, int, int, str]]
+    _hover_key: Optional[tuple]
+    _px_to_cx: bytes
+    _py_to_cy: bytes
+    _cell_origin: dict[int, tuple[int, int]]
+    status_msg: Label
+    _fading: bool
+    _fade_elapsed: float
+    _fade_alpha: int
+    _executor: ThreadPoolExecutor
+    _solve_future: Optional[Future]
+    _dirty: int
     mx: Optional[int]
     my: Optional[int]
 
@@ -72,69 +150,132 @@ class SudokuWindow(pyglet.window.Window):
 
         self.batch = pyglet.graphics.Batch()
         self.outlines = []
-        self.numbers = {}
+        self.numbers = {cell_key(x, y): Label('', font_size=30, color=(0, 0, 0, 0),
+                                              x=_CX_LABEL[x], y=_CY_LABEL[y], anchor_x='center',
+                                              anchor_y='center', batch=self.batch)
+                        for x in range(1, 10) for y in range(1, 10)}
+        self._last_rendered = {cell_key(x, y): None for x in range(1, 10) for y in range(1, 10)}
         self.cage_lines = []
+        self._cage_line_pool = []
+        self._cage_label_pool = []
         self.buttons = []
         self.button_info = [(710, 160, 200, 45), (710, 220, 200, 45), (710, 280, 200, 45),
                             (760, 490, 100, 31), (760, 530, 100, 31)]
+        self.button_names = ['Clear', 'Generate', 'Solve', 'Killer', 'Classic']
         self.cell_side = 60
-        self.track_mouse = None
-        self.invalid_msg = Label("Invalid Input!", font_name='Times New Roman', font_size=23,
-                                 color=(255, 0, 0, 0), x=825, y=80, anchor_x='center',
-                                 anchor_y='bottom', batch=self.batch)
-        self.error_msg = Label("Puzzle Unsolvable!", font_name='Times New Roman', font_size=23,
-                               color=(255, 0, 0, 0), x=825, y=80, anchor_x='center',
-                               anchor_y='bottom', batch=self.batch)
-        self.fade = 0
+        self._button_rects = [(x, x + width, y, y + height, name)
+                              for (x, y, width, height), name
+                              in zip(self.button_info, self.button_names)]
+        self._hover_key = None
+        self._px_to_cx = bytes(0 if px < 80 or px >= 620 else (px - 80) // 60 + 1
+                               for px in range(950))
+        self._py_to_cy = bytes(0 if py < 80 or py >= 620 else 9 - (py - 80) // 60
+                               for py in range(700))
+        self._cell_origin = {cell_key(cx, cy): (80 + (cx - 1) * 60, 80 + (9 - cy) * 60)
+                             for cx in range(1, 10) for cy in range(1, 10)}
+        self.track_mouse = Rectangle(0, 0, 60, 60, color=(153, 204, 255), batch=self.batch)
+        self.track_mouse.opacity = 0
+        self.status_msg = Label('', font_name='Times New Roman', font_size=23,
+                                color=(255, 0, 0, 0), x=825, y=80, anchor_x='center',
+                                anchor_y='bottom', batch=self.batch)
+        self._fading = False
+        self._fade_elapsed = 0.0
+        self._fade_alpha = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._solve_future = None
+        self._dirty = 2
         self.mx = None
         self.my = None
+        pyglet.gl.glClearColor(1, 1, 1, 1)
 
         self.draw_sudoku_outline()
         self.draw_entry_values()
         self.draw_buttons()
 
     def on_draw(self) -> None:
-        """Perform the initial drawing when the window prompts."""
-        pyglet.gl.glClearColor(1, 1, 1, 1)
+        """Redraw the window, skipping the work entirely while the scene is unchanged.
+
+        The clear colour is set once in __init__; every handler that changes the
+        scene calls _invalidate, so a static board costs no clear and no batch
+        submission per frame."""
+        if self._dirty == 0:
+            return
+
+        self._dirty -= 1
         self.clear()
         self.batch.draw()
 
+    def _invalidate(self) -> None:
+        """Request a redraw of the next two frames (one for each swap buffer)."""
+        self._dirty = 2
+
+    def on_expose(self) -> None:
+        """Redraw when a previously covered part of the window becomes visible."""
+        self._invalidate()
+
+    def on_resize(self, width: int, height: int) -> None:
+        """Update the projection for the new window size and request a redraw."""
+        super(SudokuWindow, self).on_resize(width, height)
+        self._invalidate()
+
     def draw_sudoku_outline(self) -> None:
-        """Draw the outline of the Sudoku puzzle."""
+        """Draw the outline of the Sudoku puzzle.
+
+        The twelve thin grid lines never move, so they are packed into a single
+        static vertex list that the batch draws in one call; only the four thick
+        subgrid borders remain Line shapes, as they need a quad-based width."""
+        vertices = []
         for i in range(10):
-            if i % 3 == 0:
-                width = 4
+            if _OUTLINE_WIDTHS[i] == 4:
+                self.outlines.append(Line(80 + self.cell_side * i, 80,
+                                          80 + self.cell_side * i, 620,
+                                          4, (0, 0, 0), batch=self.batch))
+                self.outlines.append(Line(80, 80 + self.cell_side * i,
+                                          620, 80 + self.cell_side * i,
+                                          4, (0, 0, 0), batch=self.batch))
             else:
-                width = 2
-            self.outlines.append(Line(80 + self.cell_side * i, 80, 80 + self.cell_side * i, 620,
-                                      width, (0, 0, 0), batch=self.batch))
-            self.outlines.append(Line(80, 80 + self.cell_side * i, 620, 80 + self.cell_side * i,
-                                      width, (0, 0, 0), batch=self.batch))
+                vertices.extend((80 + self.cell_side * i, 80, 80 + self.cell_side * i, 620))
+                vertices.extend((80, 80 + self.cell_side * i, 620, 80 + self.cell_side * i))
 
-    def draw_entry_values(self) -> None:
-        """Delete all previous label for entry values and recreate labels for all entries
-        that has a value."""
-        for coord in self.numbers:
-            self.numbers[coord].delete()
+        count = len(vertices) // 2
+        self._outline_vlist = self.batch.add(count, GL_LINES, _ThinLineGroup(),
+                                             ('v2f/static', vertices),
+                                             ('c3B/static', (0, 0, 0) * count))
 
-        self.numbers = {}
+    def draw_entry_values(self) -> None:
+        """Update the persistent entry labels so that they display the current value
+        of every entry, hiding the labels of the entries that have no value.
 
+        Only the labels whose value differs from the last rendered state are touched,
+        so a button press that changes a few cells only mutates those few labels."""
         for y in range(1, 10):
             for x in range(1, 10):
                 value = self.sudoku.get_entry(x, y)
-                if value is not None:
-                    self.numbers[(x, y)] = self.entry_label(x, y, value)
-
-    def entry_label(self, x: int, y: int, value: int) -> Label:
-        """Return a Label instance representing the entry at (x, y) with <value>."""
-        return Label(str(value), font_size=30, color=(0, 0, 0, 255), x=50 + self.cell_side * x,
-                     y=650 - self.cell_side * y, anchor_x='center', anchor_y='center',
-                     batch=self.batch)
+                k = cell_key(x, y)
+                if value == self._last_rendered[k]:
+                    continue
+
+                self._last_rendered[k] = value
+                label = self.numbers[k]
+                if value is None:
+                    label.text = ''
+                    label.color = (0, 0, 0, 0)
+                else:
+                    label.text = _DIGIT[value]
+                    label.color = (0, 0, 0, 255)
 
     def clear_cage(self) -> None:
-        """Delete all cage lines."""
+        """Hide all cage lines and cage sums and return them to the reuse pools.
+
+        Hiding instead of deleting keeps the vertex lists alive in the batch, so
+        the next draw_cage updates them in place rather than rebuilding them."""
         for cage_line in self.cage_lines:
-            cage_line.delete()
+            if isinstance(cage_line, Label):
+                cage_line.color = (0, 0, 0, 0)
+                self._cage_label_pool.append(cage_line)
+            else:
+                cage_line.opacity = 0
+                self._cage_line_pool.append(cage_line)
 
         self.cage_lines = []
 
@@ -142,112 +283,88 @@ class SudokuWindow(pyglet.window.Window):
         """Display the cages and the cage sum when the mode is Killer.
 
         The location of the cage sum will always be the top-left corner of the cage.
+        The segment endpoints are computed by cage_geom.build_cage_lines on a frozenset
+        of the cage's coordinates, so membership tests in the geometry loop are O(1).
         """
         for cage in self.sudoku.cages:
+            coords = frozenset(cell_key(x, y) for x, y in cage.coordinates)
             min_x, min_y = None, None
-            lines = []
             for x, y in cage.coordinates:
-                for ax, ay in [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]:
-                    if (ax, ay) not in cage.coordinates:
-                        lines.append(self.cage_line(x, y, ax, ay, cage.coordinates))
-
                 if min_x is None or min_y is None or x + y < min_x + min_y or \
                         x + y == min_x + min_y and y < min_y:
                     min_x, min_y = x, y
 
+            lines = [self._cage_line(lx1, ly1, lx2, ly2)
+                     for lx1, ly1, lx2, ly2 in build_cage_lines(coords)]
+
             self.cage_lines.append(self.create_cage_sum(min_x, min_y, cage.sum, lines))
             self.cage_lines.extend(lines)
 
-    def cage_line(self, x: int, y: int, ax: int, ay: int, cages: list[tuple[int, int]]) -> Line:
-        """Return a cage line based on the adjacent entries.
+    def _cage_line(self, lx1: int, ly1: int, lx2: int, ly2: int) -> Line:
+        """Return a visible cage Line with the given endpoints, reusing a pooled
+        Line when one is available."""
+        if self._cage_line_pool:
+            line = self._cage_line_pool.pop()
+            line.x, line.y, line.x2, line.y2 = lx1, ly1, lx2, ly2
+            line.opacity = 255
+            return line
 
-        Draw a cage line on a side of an entry when its adjacent entry on that side is not
-        in the same cage, and that line is drawn with extra length when the adjacent entries
-        on the direction of line is in the same cage.
-        """
-        cx, cy = (20 + x * self.cell_side, 620 - y * self.cell_side)
-        if (ax, ay) == (x + 1, y):
-            lx1, ly1, lx2, ly2 = self.extend_line1(x, y, cx, cy, cages, True)
-        elif (ax, ay) == (x - 1, y):
-            lx1, ly1, lx2, ly2 = self.extend_line1(x, y, cx, cy, cages, False)
-        elif (ax, ay) == (x, y + 1):
-            lx1, ly1, lx2, ly2 = self.extend_line2(x, y, cx, cy, cages, False)
-        else:
-            lx1, ly1, lx2, ly2 = self.extend_line2(x, y, cx, cy, cages, True)
         return Line(lx1, ly1, lx2, ly2, width=1, color=(0, 0, 230), batch=self.batch)
 
-    def extend_line1(self, x: int, y: int, cx: int, cy: int, cages: list[tuple[int, int]],
-                     right: bool) -> tuple[int, int, int, int]:
-        """Extend the line depending on whether its adjacent entry is in the cage or not."""
-        if right:
-            extension = self.cell_side - 5
-        else:
-            extension = 5
-        if (x, y + 1) in cages:
-            lx1, ly1 = cx + extension, cy - 5
-        else:
-            lx1, ly1 = cx + extension, cy + 5
-        if (x, y - 1) in cages:
-            lx2, ly2 = cx + extension, cy + self.cell_side + 5
-        else:
-            lx2, ly2 = cx + extension, cy + self.cell_side - 5
-        return lx1, ly1, lx2, ly2
-
-    def extend_line2(self, x: int, y: int, cx: int, cy: int, cages: list[tuple[int, int]],
-                     right: bool) -> tuple[int, int, int, int]:
-        """Extend the line depending on whether its adjacent entry is in the cage or not."""
-        if right:
-            extension = self.cell_side - 5
-        else:
-            extension = 5
-        if (x - 1, y) in cages:
-            lx1, ly1 = cx - 5, cy + extension
-        else:
-            lx1, ly1 = cx + 5, cy + extension
-        if (x + 1, y) in cages:
-            lx2, ly2 = cx + self.cell_side + 5, cy + extension
-        else:
-            lx2, ly2 = cx + self.cell_side - 5, cy + extension
-        return lx1, ly1, lx2, ly2
-
     def create_cage_sum(self, x: int, y: int, cage_sum: int, lines: list[Line]) -> Label:
         """Reduce the length of the two line segments to create space for the cage sum label,
         and return that label."""
-        sx, sy = (20 + x * self.cell_side, 680 - y * self.cell_side)
+        sx, sy = (_CX_CAGE_SUM[x], _CY_CAGE_SUM[y])
         for line in lines:
             if line.x - 5 == sx and line.y == sy - 5:
-                line.x += 6 * len(str(cage_sum))
+                line.x += 6 * _DIGIT_LEN[cage_sum]
             elif line.x2 - 5 == sx and line.y2 == sy - 5:
                 line.y2 -= 10
-        return Label(str(cage_sum), font_size=10, bold=True, color=(0, 0, 0, 255), x=sx + 3,
+        if self._cage_label_pool:
+            label = self._cage_label_pool.pop()
+            label.x, label.y = sx + 3, sy - 3
+            label.text = _DIGIT[cage_sum]
+            label.color = (0, 0, 0, 255)
+            return label
+
+        return Label(_DIGIT[cage_sum], font_size=10, bold=True, color=(0, 0, 0, 255), x=sx + 3,
                      y=sy - 3, anchor_x='left', anchor_y='top', batch=self.batch)
 
-    def tracking_highlight(self, x: int, y: int, width: int, height: int) -> None:
-        """Create a rectangle at (x, y) with the given width and height, assign it to
-        self.track_mouse, and make it somewhat transparent."""
-        self.track_mouse = Rectangle(x, y, width, height, color=(153, 204, 255), batch=self.batch)
-        self.track_mouse.opacity = 50
-
     def on_mouse_motion(self, x: int, y: int, dx: int, dy: int) -> None:
         """Check if the mouse is on a cell or a button. If yes, highlight that cell or
-        button. Otherwise, remove the highlight."""
+        button. Otherwise, remove the highlight.
+
+        The single highlight rectangle is allocated once in __init__; hovering moves
+        and resizes it in place, and only when the hovered cell or button changes."""
         self.mx, self.my = x, y
-        on_button = self.on_button(x, y)
         on_cell = self.on_cell(x, y)
         if on_cell is not None:
-            self.tracking_highlight(on_cell[2], on_cell[3], 60, 60)
-        elif on_button is not None:
-            x, y, width, height, _ = on_button
-            self.tracking_highlight(x, y, width, height)
+            hover_key = ('cell', cell_key(on_cell[0], on_cell[1]))
+            target = (on_cell[2], on_cell[3], 60, 60)
         else:
-            if self.track_mouse is not None:
-                self.track_mouse.delete()
-                self.track_mouse = None
+            on_button = self.on_button(x, y)
+            if on_button is None:
+                hover_key, target = None, None
+            else:
+                hover_key, target = ('button', on_button[4]), on_button[:4]
+
+        if hover_key == self._hover_key:
+            return
+
+        self._hover_key = hover_key
+        if target is None:
+            self.track_mouse.opacity = 0
+        else:
+            self.track_mouse.position = target[0], target[1]
+            self.track_mouse.width = target[2]
+            self.track_mouse.height = target[3]
+            self.track_mouse.opacity = 50
+        self._invalidate()
 
     def on_key_press(self, symbol: int, modifiers: int) -> None:
         """If the current mode is 'Classic', check if the mouse is on a cell or not. If yes,
         add, change or delete the value of that cell accordingly."""
-        if self.mode == 'Killer':
+        if self.mode == 'Killer' or self._solve_future is not None:
             return
 
         input_string = chr(symbol)
@@ -258,26 +375,30 @@ class SudokuWindow(pyglet.window.Window):
                 num = int(input_string)
 
                 if self.sudoku.change_entry(cx, cy, num):
-                    if (cx, cy) in self.numbers:
-                        self.numbers[(cx, cy)].delete()
-
-                    self.numbers[(cx, cy)] = self.entry_label(cx, cy, num)
+                    k = cell_key(cx, cy)
+                    self._last_rendered[k] = num
+                    label = self.numbers[k]
+                    label.text = _DIGIT[num]
+                    label.color = (0, 0, 0, 255)
+                    self._invalidate()
                 else:
-                    if self.fade != 0:
-                        self.fade = 0
-                        clock.unschedule(self.puzzle_unsolvable)
-                        self.error_msg.color = (255, 0, 0, 0)
-                    clock.schedule_interval(self.invalid_input, 0.055)
+                    self.start_fade('Invalid Input!')
 
             elif symbol == key.BACKSPACE:
                 self.sudoku.clear_entry(cx, cy)
-                if (cx, cy) in self.numbers:
-                    self.numbers[(cx, cy)].delete()
-                    self.numbers.pop((cx, cy), None)
+                k = cell_key(cx, cy)
+                self._last_rendered[k] = None
+                label = self.numbers[k]
+                label.text = ''
+                label.color = (0, 0, 0, 0)
+                self._invalidate()
 
     def on_mouse_release(self, x: int, y: int, button: bool, modifiers: int) -> None:
         """Check if the mouse is on a button. If yes, execute the corresponding function of
         that button."""
+        if self._solve_future is not None:
+            return
+
         button = self.on_button(x, y)
         if button is not None:
             _, _, _, _, name = button
@@ -292,12 +413,7 @@ class SudokuWindow(pyglet.window.Window):
                     self.sudoku.generate('human_killer_sudoku.pkl')
                     self.draw_cage()
             elif name == 'Solve':
-                if not self.sudoku.solve():
-                    if self.fade != 0:
-                        self.fade = 0
-                        clock.unschedule(self.invalid_input)
-                        self.invalid_msg.color = (255, 0, 0, 0)
-                    clock.schedule_interval(self.puzzle_unsolvable, 0.055)
+                self._start_solve()
             elif name == 'Killer':
                 self.mode = 'Killer'
                 self.sudoku = self.sudoku_dict[self.mode]
@@ -307,6 +423,46 @@ class SudokuWindow(pyglet.window.Window):
                 self.sudoku = self.sudoku_dict[self.mode]
                 self.clear_cage()
             self.draw_entry_values()
+            self._invalidate()
+
+    def _start_solve(self) -> None:
+        """Submit the current puzzle to the solver thread and start polling for the
+        result, so the event loop keeps handling input and redraws during the solve.
+
+        A classic puzzle is solved through solver_core.solve_grid, which backtracks
+        over flat integer arrays instead of the vertex graph; only the cells it
+        fills are written back once it finishes. A killer puzzle uses the graph
+        solver, as the flat kernel has no notion of cages."""
+        if self.mode == 'Classic':
+            grid = [self.sudoku.get_entry(x, y) or 0
+                    for y in range(1, 10) for x in range(1, 10)]
+            self._solve_future = self._executor.submit(solve_grid, grid)
+        else:
+            self._solve_future = self._executor.submit(self.sudoku.solve)
+        clock.schedule_interval(self._poll_solve, 1 / 30)
+
+    def _poll_solve(self, dt: float) -> None:
+        """Apply the result of the background solve once it has finished."""
+        future = self._solve_future
+        if not future.done():
+            return
+
+        clock.unschedule(self._poll_solve)
+        self._solve_future = None
+        result = future.result()
+        if self.mode == 'Classic':
+            if result is None:
+                self.start_fade('Puzzle Unsolvable!')
+            else:
+                for y in range(1, 10):
+                    for x in range(1, 10):
+                        if self.sudoku.get_entry(x, y) is None:
+                            self.sudoku.assign(x, y, result[(y - 1) * 9 + (x - 1)])
+        elif not result:
+            self.start_fade('Puzzle Unsolvable!')
+
+        self.draw_entry_values()
+        self._invalidate()
 
     def draw_buttons(self) -> None:
         """Create Line and Label objects for the buttons."""
@@ -315,7 +471,7 @@ class SudokuWindow(pyglet.window.Window):
                                   color=(0, 0, 0, 255), x=810, y=580, anchor_x='center',
                                   anchor_y='baseline', batch=self.batch))
 
-        names = ['Clear', 'Generate', 'Solve', 'Killer', 'Classic']
+        names = self.button_names
         for i in range(len(self.button_info)):
             x, y, width, height = self.button_info[i]
             objects = [
@@ -337,11 +493,9 @@ class SudokuWindow(pyglet.window.Window):
         """If the given coordinate (mx, my) is above a button, return the button's left-bottom
         corner coordinate, its width, its height, and its name as a 5-tuple. Otherwise, return None.
         """
-        names = ['Clear', 'Generate', 'Solve', 'Killer', 'Classic']
-        for i in range(len(self.button_info)):
-            x, y, width, height = self.button_info[i]
-            if x <= mx <= x + width and y <= my <= y + height:
-                return (x, y, width, height, names[i])
+        for x1, x2, y1, y2, name in self._button_rects:
+            if x1 <= mx <= x2 and y1 <= my <= y2:
+                return (x1, y1, x2 - x1, y2 - y1, name)
 
         return None
 
@@ -349,39 +503,45 @@ class SudokuWindow(pyglet.window.Window):
         """If the given coordinate (mx, my) is above a cell, return the cell's coordinate (x, y)
         where 1 <= x, y <= 9, as well as its left corner coordinate on the screen. Otherwise,
         return None."""
-        coordinate = ((mx - 80) // self.cell_side + 1, 9 - (my - 80) // self.cell_side)
-        if 1 <= coordinate[0] <= 9 and 1 <= coordinate[1] <= 9:
-            return (coordinate[0], coordinate[1],
-                    80 + (coordinate[0] - 1) * self.cell_side,
-                    80 + (9 - coordinate[1]) * self.cell_side)
+        cx = self._px_to_cx[mx] if 0 <= mx < 950 else 0
+        cy = self._py_to_cy[my] if 0 <= my < 700 else 0
+        if cx and cy:
+            return (cx, cy) + self._cell_origin[cell_key(cx, cy)]
 
         return None
 
-    def invalid_input(self, dt: float) -> None:
-        """Display the message "Invalid Input!" at the right bottom corner.
-
-        The color of this message fades every time this method is called, and eventually
-        disappear after 51 times.
-        """
-        self.invalid_msg.color = (255, 0, 0, 255 - 5 * self.fade)
-        if self.fade == 51:
-            self.fade = 0
-            clock.unschedule(self.invalid_input)
-        else:
-            self.fade += 1
-
-    def puzzle_unsolvable(self, dt: float) -> None:
-        """Display the message "Puzzle Unsolvable!" at the right bottom corner.
+    def start_fade(self, message: str) -> None:
+        """Display the given message at the right bottom corner and start fading it
+        out, replacing whichever message is currently fading.
+
+        Both messages share the single status_msg label and _fade_tick callback, so at
+        most one schedule is ever active and none is when no message is shown."""
+        if self._fading:
+            clock.unschedule(self._fade_tick)
+        self._fading = True
+        self._fade_elapsed = 0.0
+        self._fade_alpha = 255
+        self.status_msg.text = message
+        self.status_msg.color = (255, 0, 0, 255)
+        self._invalidate()
+        clock.schedule_interval(self._fade_tick, 1 / 60)
+
+    def _fade_tick(self, dt: float) -> None:
+        """Fade the status message, and stop the schedule once it is transparent.
+
+        The label colour is only written when the integer alpha actually changed since
+        the last tick, as a Label colour write is a non-trivial batch update."""
+        self._fade_elapsed += dt
+        alpha = max(0, 255 - int(90 * self._fade_elapsed))
+        if alpha == self._fade_alpha:
+            return
 
-        The color of this message fades every time this method is called, and eventually
-        disappear after 51 times.
-        """
-        self.error_msg.color = (255, 0, 0, 255 - 5 * self.fade)
-        if self.fade == 51:
-            self.fade = 0
-            clock.unschedule(self.puzzle_unsolvable)
-        else:
-            self.fade += 1
+        self._fade_alpha = alpha
+        self.status_msg.color = (255, 0, 0, alpha)
+        self._invalidate()
+        if alpha == 0:
+            clock.unschedule(self._fade_tick)
+            self._fading = False
 
 
 if __name__ == '__main__':
@@ -391,7 +551,9 @@ if __name__ == '__main__':
     python_ta.check_all()
 
     python_ta.check_all(config={
-        'extra-imports': ['pyglet', 'sudoku', 'pyglet.shapes', 'pyglet.text', 'pyglet.window'],
+        'extra-imports': ['pyglet', 'sudoku', 'cage_geom', 'solver_core',
+                          'concurrent.futures', 'pyglet.shapes', 'pyglet.text',
+                          'pyglet.window'],
         'allowed-io': [],
         'max-line-length': 100,
         'disable': ['E1136'],
@@ -400,5 +562,5 @@ if __name__ == '__main__':
     # In pyglet tutorial, children of pyglet.window.Window does not need to
     # implement all abstract methods.
     #
-    # The dt parameter for invalid_input and puzzle_unsolvable is required for
+    # The dt parameter for _fade_tick and _poll_solve is required for
     # clock.schedule_interval
@@ -0,0 +1,114 @@
+"""CSC111 Winter 2021 Project: Sudoku Solver
+
+This module contains a flat-grid solver for classic Sudoku puzzles. Unlike the
+graph solver in sudoku.py, which works on connected _Vertex objects so that it can
+also express Killer Sudoku cages, this solver represents the grid as 81 integers
+and the candidates of each cell as a 9-bit mask, and backtracks over those arrays
+directly. The interface uses it as a fast path when solving a classic puzzle; the
+graph solver remains the implementation for Killer Sudoku and for puzzle
+generation. The kernel only touches fixed-size integer lists, which also keeps it
+ready to be compiled with Cython should it ever need more speed.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright (c) 2021 Raymond Liu
+"""
+from typing import Optional
+
+# A 9-bit candidate mask with bit v - 1 representing the candidate value v.
+ALL_VALUES = 0x1FF
+
+
+def _cell_peers(i: int) -> tuple[int, ...]:
+    """Return the indices of the cells in the same row, column, or subgrid as cell <i>."""
+    row, col = divmod(i, 9)
+    box = (row // 3, col // 3)
+    return tuple(j for j in range(81) if j != i
+                 and (j // 9 == row or j % 9 == col or (j // 9 // 3, j % 9 // 3) == box))
+
+
+# The 20 peers of each of the 81 cells, in row-major order.
+PEERS = tuple(_cell_peers(i) for i in range(81))
+
+
+def solve_grid(values: list[int]) -> Optional[list[int]]:
+    """Return the solution of the classic Sudoku puzzle given as a flat list of 81
+    values in row-major order, with 0 for an empty cell, or None if the puzzle is
+    unsolvable. The input list is not mutated.
+
+    Preconditions:
+        - len(values) == 81
+        - all(0 <= v <= 9 for v in values)
+    """
+    vals = list(values)
+    cands = [ALL_VALUES] * 81
+
+    for i in range(81):
+        value = vals[i]
+        if value:
+            bit = 1 << (value - 1)
+            cands[i] = 0
+            for p in PEERS[i]:
+                if vals[p] == value:
+                    return None
+                cands[p] &= ~bit
+
+    if _search(vals, cands):
+        return vals
+
+    return None
+
+
+def _search(vals: list[int], cands: list[int]) -> bool:
+    """Solve the puzzle state given by the value and candidate-mask lists by
+    backtracking over the cell with the fewest candidates, mutating both lists.
+
+    Return whether the state is solvable; vals holds the solution when it is.
+    """
+    best_i = -1
+    best_n = 10
+    for i in range(81):
+        if not vals[i]:
+            num_cands = cands[i].bit_count()
+            if num_cands == 0:
+                return False
+            if num_cands < best_n:
+                best_i, best_n = i, num_cands
+                if num_cands == 1:
+                    break
+
+    if best_i == -1:
+        return True
+
+    mask = cands[best_i]
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+
+        saved_cands = list(cands)
+        vals[best_i] = bit.bit_length()
+        cands[best_i] = 0
+        for p in PEERS[best_i]:
+            cands[p] &= ~bit
+
+        if _search(vals, cands):
+            return True
+
+        vals[best_i] = 0
+        cands[:] = saved_cands
+
+    return False
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    python_ta.check_all(config={
+        'extra-imports': [],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136'],
+        'max-nested-blocks': 4,
+    })
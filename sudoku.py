@@ -21,10 +21,113 @@ This file is Copyright (c) 2021 Raymond Liu
 from __future__ import annotations
 from typing import Optional, Callable, Union
 from dataclasses import dataclass
-import copy
+from collections import deque
 import random
 import pickle
 import pprint
+import struct
+
+from solver_core import solve_grid
+
+# A 9-bit candidate bitmask with bit v - 1 representing the candidate value v.
+ALL_VALUES = 0x1FF
+
+
+def _mask_to_values(mask: int) -> list[int]:
+    """Return the values whose bits are set in the given candidate mask, ascending."""
+    values = []
+    while mask:
+        bit = mask & -mask
+        values.append(bit.bit_length())
+        mask ^= bit
+    return values
+
+
+def _entry_index(x: int, y: int) -> int:
+    """Return the index of the entry at (x, y) in a puzzle's flat entry list.
+
+    Preconditions:
+        - 1 <= x <= 9 and 1 <= y <= 9
+    """
+    return (x - 1) * 9 + (y - 1)
+
+
+def _house_cell_indices() -> tuple[tuple[int, ...], ...]:
+    """Return the flat indices of the 9 cells of each of the 27 houses of the grid:
+    the 9 rows, then the 9 columns, then the 9 subgrids."""
+    houses = []
+    for y in range(1, 10):
+        houses.append(tuple(_entry_index(x, y) for x in range(1, 10)))
+    for x in range(1, 10):
+        houses.append(tuple(_entry_index(x, y) for y in range(1, 10)))
+    for sx in range(1, 10, 3):
+        for sy in range(1, 10, 3):
+            houses.append(tuple(_entry_index(x, y)
+                                for x in range(sx, sx + 3) for y in range(sy, sy + 3)))
+    return tuple(houses)
+
+
+HOUSE_CELLS = _house_cell_indices()
+
+# The row, column, and subgrid house ids (indices into HOUSE_CELLS) of each cell.
+CELL_HOUSES = tuple((idx % 9, 9 + idx // 9, 18 + idx // 9 // 3 * 3 + idx % 9 // 3)
+                    for idx in range(81))
+
+
+def _peer_indices() -> tuple[tuple[int, ...], ...]:
+    """Return the flat indices of the 20 peers of each of the 81 entries: the
+    other entries in its row, column, and subgrid."""
+    peers = []
+    for idx in range(81):
+        cells = set()
+        for h in CELL_HOUSES[idx]:
+            cells.update(HOUSE_CELLS[h])
+        cells.discard(idx)
+        peers.append(tuple(sorted(cells)))
+    return tuple(peers)
+
+
+PEER_IDX = _peer_indices()
+
+# Each entry's 20 peers as an 81-bit mask, the bitwise counterpart of PEER_IDX.
+PEER_BITS = tuple(sum(1 << p for p in idxs) for idxs in PEER_IDX)
+
+# Each house's cells as an 81-bit mask, bit i representing the cell at flat index i.
+HOUSE_MASK = tuple(sum(1 << idx for idx in house) for house in HOUSE_CELLS)
+
+
+def _cage_combo_masks() -> dict[tuple[int, int], tuple[int, ...]]:
+    """Return every set of distinct values 1-9 as a 9-bit mask, grouped by the
+    (number of values, sum of values) of the set, for looking up which value
+    combinations can still complete a cage."""
+    combos = {}
+    for mask in range(1, ALL_VALUES + 1):
+        key = (mask.bit_count(), sum(_mask_to_values(mask)))
+        combos.setdefault(key, []).append(mask)
+    return {key: tuple(masks) for key, masks in combos.items()}
+
+
+CAGE_COMBOS = _cage_combo_masks()
+
+# Cap on the number of unsolvable states a solve remembers, to bound its memory.
+NOGOOD_LIMIT = 1 << 16
+
+# Per-file cache of dataset puzzles, re-pickled one blob per puzzle so that a
+# generate() call deserializes only the puzzle it picks.
+_DATASET_CACHE: dict[str, list[bytes]] = {}
+
+
+def _load_dataset(filename: str) -> list[bytes]:
+    """Return the puzzles of the given dataset file, each as its own pickled blob.
+
+    The file is read and parsed only on the first call; afterwards, taking a fresh
+    copy of one puzzle is a single pickle.loads of its blob instead of a reload of
+    the whole dataset."""
+    if filename not in _DATASET_CACHE:
+        with open(filename, 'rb') as file:
+            puzzles = pickle.load(file)
+        _DATASET_CACHE[filename] = [pickle.dumps(puzzle) for puzzle in puzzles]
+    return _DATASET_CACHE[filename]
 
 
 class Sudoku:
@@ -34,41 +137,87 @@ class Sudoku:
         - _entries: a dictionary that maps the coordinate of each entry to the vertex
         representing that entry; (1, 1) represents the top-left corner of the grid,
         (1, 2) represents the entry below the top-left entry, etc.
+        - _entries_list: the same vertices in a flat list indexed by
+        (x - 1) * 9 + (y - 1), which the solver hot paths use because a list
+        index is several times cheaper than hashing a coordinate tuple.
+        - _nogood: the signatures of solving states that solve() has proven
+        unsolvable, so that a state reached again through a different order of
+        choices is abandoned without redoing its whole subtree.
+        - _empty: the number of entries without a value, maintained by solve()
+        so that _search can test for a solved puzzle in O(1).
     """
     _entries: dict[tuple[int, int], _Vertex]
+    _entries_list: list[_Vertex]
+    _nogood: set[bytes]
+    _empty: int
+
+    def _index_entries(self) -> None:
+        """Build the flat list of entries indexed by (x - 1) * 9 + (y - 1).
+
+        This must be called again whenever self._entries is replaced wholesale,
+        such as after loading a puzzle from a dataset file."""
+        self._entries_list = [self._entries[(x, y)]
+                              for x in range(1, 10) for y in range(1, 10)]
+        for idx, entry in enumerate(self._entries_list):
+            entry.idx = idx
 
     def solve(self) -> bool:
         """Return whether the puzzle is solvable or not. If it is solvable, all the entries
         will be mutated to the solution. If it is unsolvable, then do no changes to the
         entries and return False.
         """
-        original = copy.deepcopy(self._entries)
+        original = self._record_state()
         state_copies = []
+        self._nogood = set()
+        self._empty = len(original)
 
         entry, unique_value = self._search()
 
         while entry is not None:
+            mask = entry.valid_values
             if unique_value is not None:
                 next_assign = entry.assign(unique_value)
+                self._empty -= 1
 
-            elif len(entry.valid_values) == 0:
-                # print('dead end')
-                if len(state_copies) == 0:
-                    self._entries = original
-                    return False
-                state_copy, prev_choice, coordinate = state_copies.pop()
-                self._entries = state_copy
-                next_assign = self._entries[coordinate]
-                next_assign.valid_values.discard(prev_choice)
-
-            elif len(entry.valid_values) == 1:
-                next_assign = entry.assign(next(iter(entry.valid_values)))
+            elif mask != 0 and mask & (mask - 1) == 0:
+                next_assign = entry.assign(mask.bit_length())
+                self._empty -= 1
 
             else:
-                # print('multiple choice')
-                state_copy, prev_choice, coordinate = self._record_state(entry)
-                state_copies.append((state_copy, prev_choice, coordinate))
-                next_assign = entry.assign(prev_choice)
+                key = self._state_key() if mask != 0 else None
+
+                if key is not None and key not in self._nogood:
+                    # print('multiple choice')
+                    prev_choice = (mask & -mask).bit_length()
+                    state_copies.append((self._record_state(), prev_choice, entry, key))
+                    next_assign = entry.assign(prev_choice)
+                    self._empty -= 1
+
+                else:
+                    # print('dead end')
+                    if len(state_copies) == 0:
+                        self._restore_state(original)
+                        return False
+                    state_copy, prev_choice, branch_entry, branch_key = state_copies.pop()
+                    self._restore_state(state_copy)
+                    branch_entry.valid_values &= ~(1 << (prev_choice - 1))
+
+                    remaining = branch_entry.valid_values
+                    if remaining == 0:
+                        # Every choice of the branch state has now failed, so the
+                        # state itself is unsolvable.
+                        if len(self._nogood) < NOGOOD_LIMIT:
+                            self._nogood.add(branch_key)
+                        next_assign = branch_entry
+                    elif remaining & (remaining - 1) == 0:
+                        # Keep the branch on the stack for its last choice, so the
+                        # state is recognized as exhausted if that choice fails too.
+                        state_copies.append((self._record_state(), remaining.bit_length(),
+                                             branch_entry, branch_key))
+                        next_assign = branch_entry.assign(remaining.bit_length())
+                        self._empty -= 1
+                    else:
+                        next_assign = branch_entry
 
             if next_assign is not None:
                 entry, unique_value = next_assign, None
@@ -84,69 +233,84 @@ class Sudoku:
 
         Otherwise, return the entry with the minimum number of valid_values.
 
-        Return None if all entry already has a value -- the puzzle is solved.
+        Return None if all entry already has a value -- the puzzle is solved; this
+        is answered by the _empty counter maintained in solve() without a scan.
         """
-        min_valid_value = None
-        num_filled = 0
-        for coordinate in self._entries:
-            entry = self._entries[coordinate]
+        if self._empty == 0:
+            return (None, None)
 
-            if entry.value is None:
-                num_valid_values = len(entry.valid_values)
-                unique_value = self._unique_valid_value(coordinate)
+        entries = self._entries_list
+        unique_bits = self._hidden_single_bits()
 
-                if num_valid_values == 0:
+        min_valid_value = None
+        min_count = 10
+        for idx, entry in enumerate(entries):
+            if entry.value is None:
+                mask = entry.valid_values
+                if mask == 0:
                     return (entry, None)
-                elif num_valid_values == 1 or unique_value is not None:
-                    return (entry, unique_value)
-                elif min_valid_value is None or \
-                        num_valid_values < len(min_valid_value.valid_values):
-                    min_valid_value = entry
 
-            else:
-                num_filled += 1
+                houses = CELL_HOUSES[idx]
+                hidden = mask & (unique_bits[houses[0]] | unique_bits[houses[1]]
+                                 | unique_bits[houses[2]])
+                if hidden:
+                    return (entry, (hidden & -hidden).bit_length())
+                elif mask & (mask - 1) == 0:
+                    return (entry, None)
 
-        if num_filled == 81:
-            return (None, None)
-        else:
-            return (min_valid_value, None)
-
-    def _unique_valid_value(self, coordinate: tuple[int, int]) -> Optional[int]:
-        """Return the valid value of the entry at (x, y) that is not in the valid values
-        of all of its row neighbours, all of its column neighbours, or all of its subgrid
-        neighbours, if there is any; otherwise return None."""
-        x, y = coordinate
-        entry = self._entries[(x, y)]
-
-        for value in entry.valid_values:
-            if all(value not in self._entries[(i, y)].valid_values
-                   for i in range(1, 10) if i != x):
-                return value
-
-            if all(value not in self._entries[(x, j)].valid_values
-                   for j in range(1, 10) if j != y):
-                return value
-
-            subgrid = ((x - 1) // 3 * 3 + 1, (y - 1) // 3 * 3 + 1)
-            if all(value not in self._entries[(k1, k2)].valid_values
-                   for k1 in range(subgrid[0], subgrid[0] + 3)
-                   for k2 in range(subgrid[1], subgrid[1] + 3)
-                   if k1 != x or k2 != y):
-                return value
-
-        return None
-
-    def _record_state(self, entry: _Vertex) -> \
-            tuple[dict[tuple[int, int], _Vertex], int, tuple[int, int]]:
-        """Return a deep copy of self._entries, a value in entry's valid_values, and
-        the coordinate of that entry."""
-        state_record = copy.deepcopy(self._entries)
-        choice = next(iter(entry.valid_values))
-        coordinate = None
-        for key in self._entries:
-            if self._entries[key] is entry:
-                coordinate = key
-        return state_record, choice, coordinate
+                num_valid_values = mask.bit_count()
+                if num_valid_values < min_count:
+                    min_valid_value = entry
+                    min_count = num_valid_values
+
+        return (min_valid_value, None)
+
+    def _hidden_single_bits(self) -> list[int]:
+        """Return, for each of the 27 houses, the bitmask of values that are valid in
+        exactly one empty entry of that house. Such a value is a hidden single: the
+        entry holding its bit is the only one in the house that can take it.
+
+        Filled entries have an empty valid_values mask, so they never contribute."""
+        entries = self._entries_list
+        unique_bits = [0] * 27
+        for h in range(27):
+            once = 0
+            twice = 0
+            for j in HOUSE_CELLS[h]:
+                mask = entries[j].valid_values
+                twice |= once & mask
+                once |= mask
+            unique_bits[h] = once & ~twice
+        return unique_bits
+
+    def _record_state(self) -> list[tuple[_Vertex, int]]:
+        """Return a snapshot of the valid values of every empty entry.
+
+        Only the value and valid_values of empty entries are mutated while solving,
+        so this snapshot is enough to undo a branch in place with _restore_state --
+        no deep copy of the graph is ever taken.
+        """
+        return [(entry, entry.valid_values)
+                for entry in self._entries_list if entry.value is None]
+
+    def _restore_state(self, state_record: list[tuple[_Vertex, int]]) -> None:
+        """Restore the entries recorded by _record_state, clearing every entry that
+        was empty when the snapshot was taken."""
+        for entry, valid_values in state_record:
+            entry.value = None
+            entry.valid_values = valid_values
+        self._empty = len(state_record)
+
+    def _state_key(self) -> bytes:
+        """Return a compact signature of the current solving state: one 16-bit word
+        per entry holding its candidate mask, with the value of a filled entry
+        (whose mask is always empty) packed into the upper bits."""
+        return struct.pack('<81H', *[(entry.value or 0) << 9 | entry.valid_values
+                                     for entry in self._entries_list])
+
+    def _snapshot(self) -> list[tuple[Optional[int], int]]:
+        """Return the value and candidate mask of every entry, in flat-list order."""
+        return [(entry.value, entry.valid_values) for entry in self._entries_list]
 
     def generate_puzzle(self) -> dict[tuple[int, int], _Vertex]:
         """Generate a new solvable puzzle."""
@@ -165,38 +329,17 @@ class Sudoku:
         """Clear the puzzle to its initial state."""
         raise NotImplementedError
 
-    def _connect_entries(self, x: int, y: int, vertex: Callable) -> None:
-        """Create a new instance of _Vertex as a new entry for the puzzle,
-        and create an edge between all previously created entries that are in
-        the same row, column, and 3 x 3 subgrid with it.
-
-        Preconditions:
-            - 1 <= row <= 9
-            - 1 <= col <= 9
-        """
-        new_entry = vertex()
-        self._entries[(x, y)] = new_entry
-
-        for k in range(1, x + 1):
-            self._add_edge(k, y, new_entry)
-        for k in range(1, y + 1):
-            self._add_edge(x, k, new_entry)
-
-        subgrid = ((x - 1) // 3 * 3 + 1, (y - 1) // 3 * 3 + 1)
-        for k2 in range(subgrid[1], y):
-            for k1 in range(subgrid[0], subgrid[0] + 3):
-                self._add_edge(k1, k2, new_entry)
+    def _build_entries(self, vertex: Callable) -> None:
+        """Create the 81 entries of an empty puzzle and connect each entry to its
+        20 peers -- the other entries in the same row, column, and 3 x 3 subgrid --
+        from the precomputed PEER_IDX table, instead of discovering the edges with
+        per-entry coordinate loops."""
+        self._entries = {(x, y): vertex() for x in range(1, 10) for y in range(1, 10)}
+        self._index_entries()
 
-    def _add_edge(self, i: int, j: int, v: _Vertex) -> None:
-        """Add an edge between the entry at (x, y) and the given entry.
-
-        Preconditions:
-            - 1 <= i <= 9 and 1 <= j <= 9
-        """
-        u = self._entries[(i, j)]
-        if u is not v:
-            v.neighbours.add(u)
-            u.neighbours.add(v)
+        entries = self._entries_list
+        for idx in range(81):
+            entries[idx].neighbours = frozenset(entries[p] for p in PEER_IDX[idx])
 
     def assign(self, x: int, y: int, value: int) -> None:
         """Assign the given value to the entry at (x, y) in the Sudoku puzzle.
@@ -204,7 +347,7 @@ class Sudoku:
         Preconditions:
             - 1 <= x <= 9 and 1 <= y <= 9 and 1 <= value <= 9
         """
-        self._entries[(x, y)].assign(value)
+        self._entries_list[(x - 1) * 9 + (y - 1)].assign(value)
 
     def get_entry(self, x: int, y: int) -> Optional[int]:
         """Return the value of the entry at coordinate (x, y).
@@ -212,7 +355,7 @@ class Sudoku:
         Preconditions:
             - 1 <= x <= 9 and 1 <= y <= 9
         """
-        return self._entries[(x, y)].value
+        return self._entries_list[(x - 1) * 9 + (y - 1)].value
 
     def print_puzzle(self) -> None:
         """Print the current puzzle."""
@@ -240,20 +383,37 @@ class _Vertex:
     Public attributes:
         - value: the current value of this entry in the Sudoku game. This value is
         by default None until it is filled.
-        - neighbours: a set containing all entries in the Sudoku game that may be
-        influenced by changes in this entry.
-        - valid_values: a set containing all valid values that this entry can have
-        without violating the rule of the game.
+        - neighbours: a frozenset containing all entries in the Sudoku game that may
+        be influenced by changes in this entry. The set is fixed once the grid is
+        built, so it is stored frozen.
+        - valid_values: a 9-bit integer bitmask of all valid values that this entry can
+        have without violating the rule of the game; bit v - 1 is set when the value v
+        is valid. Bitwise operations replace the set operations of the old representation
+        because they are a fraction of the cost in the solver's hot loop.
+        - idx: the index of this entry in its puzzle's flat entry list, set by
+        Sudoku._index_entries, so that positional lookups never need to search
+        for an entry's coordinate.
     """
     value: Optional[int]
-    neighbours: set[_Vertex]
-    valid_values: set[int]
+    neighbours: frozenset[_Vertex]
+    valid_values: int
+    idx: int
 
     def __init__(self) -> None:
         """Initialize an entry."""
         self.value = None
-        self.neighbours = set()
-        self.valid_values = {1, 2, 3, 4, 5, 6, 7, 8, 9}
+        self.neighbours = frozenset()
+        self.valid_values = ALL_VALUES
+
+    def __setstate__(self, state: dict) -> None:
+        """Restore a pickled entry, converting the valid values of entries that were
+        pickled as sets (the format of the bundled puzzle datasets) to bitmasks, and
+        freezing the neighbour set."""
+        valid_values = state['valid_values']
+        if not isinstance(valid_values, int):
+            state['valid_values'] = sum(1 << (v - 1) for v in valid_values)
+        state['neighbours'] = frozenset(state['neighbours'])
+        self.__dict__.update(state)
 
     def assign(self, value: int) -> Optional[_Vertex]:
         """Assign the given value to this entry and mutate the valid values of all
@@ -269,14 +429,37 @@ class ClassicSudoku(Sudoku):
     def __init__(self) -> None:
         """Initialize a classic Sudoku puzzle by setting every entry(vertex) as
         empty."""
-        # self._entries = {}
-
-        # for y in range(1, 10):
-        #     for x in range(1, 10):
-        #         self._connect_entries(x, y, _ClaVertex)
+        # self._build_entries(_ClaVertex)
 
         self.generate('classic_sudoku.pkl')
 
+    def solve(self) -> bool:
+        """Return whether the puzzle is solvable or not. If it is solvable, all the entries
+        will be mutated to the solution. If it is unsolvable, then do no changes to the
+        entries and return False.
+
+        A classic puzzle has no cage constraints, so instead of the graph solver this
+        packs the grid into the flat list form of solver_core.solve_grid, which
+        backtracks over plain integer lists, and unpacks the solution through assign
+        so that the valid values of the entries stay consistent.
+        """
+        entries = self._entries_list
+        grid = [0] * 81
+        for idx in range(81):
+            value = entries[idx].value
+            if value is not None:
+                grid[idx % 9 * 9 + idx // 9] = value
+
+        solution = solve_grid(grid)
+        if solution is None:
+            return False
+
+        for idx in range(81):
+            entry = entries[idx]
+            if entry.value is None:
+                entry.assign(solution[idx % 9 * 9 + idx // 9])
+        return True
+
     def generate_puzzle(self) -> dict[tuple[int, int], _ClaVertex]:
         """Generate and return a new Sudoku puzzle.
 
@@ -286,22 +469,34 @@ class ClassicSudoku(Sudoku):
         self.clear()
         num_fill = random.randint(23, 33)
         self._fill_random_entries(num_fill)
-        puzzle = copy.deepcopy(self._entries)
+        snapshot = self._snapshot()
 
         while not self.solve():
             self.clear()
             self._fill_random_entries(num_fill)
-            puzzle = copy.deepcopy(self._entries)
+            snapshot = self._snapshot()
 
         self.clear()
 
-        return puzzle
+        return self._clone_puzzle(snapshot)
+
+    def _clone_puzzle(self, snapshot: list[tuple[Optional[int], int]]) \
+            -> dict[tuple[int, int], _ClaVertex]:
+        """Return a new entry graph holding the snapshotted values and candidate
+        masks, sharing no vertices with this puzzle. Building a fresh graph from
+        the peer table and writing the snapshot into it is far cheaper than deep
+        copying the interconnected vertices."""
+        clone = ClassicSudoku.__new__(ClassicSudoku)
+        clone._build_entries(_ClaVertex)
+        for entry, (value, valid_values) in zip(clone._entries_list, snapshot):
+            entry.value, entry.valid_values = value, valid_values
+        return clone._entries
 
     def generate(self, filename: str) -> None:
         """Take a random puzzle from the previously generated puzzle file and assign
         it to self._entries."""
-        with open(filename, 'rb') as file:
-            self._entries = random.choice(pickle.load(file))
+        self._entries = pickle.loads(random.choice(_load_dataset(filename)))
+        self._index_entries()
 
     def _fill_random_entries(self, num: int = 0) -> None:
         """Randomly fill <num> entries in the empty puzzle with random values."""
@@ -311,41 +506,97 @@ class ClassicSudoku(Sudoku):
         while i < num:
             entry = random.choice(entries)
             if entry.value is None:
-                if entry.valid_values == set():
+                mask = entry.valid_values
+                if mask == 0:
                     return
-                entry.assign(random.choice(list(entry.valid_values)))
+
+                # Pick a uniformly random set bit by stripping k low bits off the mask.
+                k = random.randrange(mask.bit_count())
+                while k:
+                    mask &= mask - 1
+                    k -= 1
+                entry.assign((mask & -mask).bit_length())
                 i += 1
 
     def clear(self) -> None:
         """Clear the value of all entries in the puzzle."""
         for entry in self._entries.values():
-            entry.value, entry.valid_values = None, {1, 2, 3, 4, 5, 6, 7, 8, 9}
+            entry.value, entry.valid_values = None, ALL_VALUES
 
     def change_entry(self, x: int, y: int, value: int) -> bool:
         """Return whether the entry at (x, y) can be changed/assigned to the given <value>.
 
+        If True, the entry's value and valid_values are changed and the valid_values
+        of its neighbours mutated accordingly; otherwise nothing changes. Whether a
+        neighbour regains the replaced value is decided against an 81-bit mask of
+        the entries holding that value, instead of scanning each neighbour's own
+        neighbours.
+
         Preconditions:
             - 1 <= x <= 9 and 1 <= y <= 9
         """
-        return self._entries[(x, y)].change(value)
+        entry = self._entries_list[(x - 1) * 9 + (y - 1)]
+        if any(u.value == value for u in entry.neighbours if u.value is not None):
+            return False
+
+        if entry.value is None:
+            if entry.valid_values & (1 << (value - 1)):
+                entry.assign(value)
+                return True
+            else:
+                return False
+
+        holders = self._value_holders(entry.value) & ~(1 << entry.idx)
+        old_bit, new_bit = 1 << (entry.value - 1), 1 << (value - 1)
+        for v in entry.neighbours:
+            if v.value is None:
+                if holders & PEER_BITS[v.idx] == 0:
+                    v.valid_values |= old_bit
+                v.valid_values &= ~new_bit
+        entry.value = value
+        return True
 
     def clear_entry(self, x: int, y: int) -> None:
-        """Clear the value of the entry at (x, y).
+        """Clear the value of the entry at (x, y), re-calculating its valid_values from
+        the values of its neighbours and mutating their valid_values in turn.
 
         Preconditions:
             - 1 <= x <= 9 and 1 <= y <= 9
         """
-        self._entries[(x, y)].clear()
+        entry = self._entries_list[(x - 1) * 9 + (y - 1)]
+        if entry.value is None:
+            return
+
+        holders = self._value_holders(entry.value) & ~(1 << entry.idx)
+        old_bit = 1 << (entry.value - 1)
+        entry.valid_values = ALL_VALUES
+
+        for v in entry.neighbours:
+            if v.value is None:
+                if holders & PEER_BITS[v.idx] == 0:
+                    v.valid_values |= old_bit
+            else:
+                entry.valid_values &= ~(1 << (v.value - 1))
+        entry.value = None
+
+    def _value_holders(self, value: int) -> int:
+        """Return an 81-bit mask of the entries currently holding the given value."""
+        holders = 0
+        for idx, entry in enumerate(self._entries_list):
+            if entry.value == value:
+                holders |= 1 << idx
+        return holders
 
 
 class _ClaVertex(_Vertex):
     """An entry in a classic Sudoku game represented using a vertex.
 
     Public attributes:
-        - neighbours: a set containing all entries in the Sudoku game that relates to
-        this entry. Namely, the entry that is on the same row, column, and 3 x 3 grid.
+        - neighbours: a frozenset containing all entries in the Sudoku game that
+        relates to this entry. Namely, the entry that is on the same row, column,
+        and 3 x 3 grid.
     """
-    neighbours: set[_ClaVertex]
+    neighbours: frozenset[_ClaVertex]
 
     def assign(self, value: int) -> Optional[_ClaVertex]:
         """Assign a value to this entry, and updating the valid values of
@@ -358,56 +609,20 @@ class _ClaVertex(_Vertex):
             - value in self.valid_values
         """
         self.value = value
-        self.valid_values = set()
+        self.valid_values = 0
 
+        keep = ~(1 << (value - 1))
         next_assign = None
         for v in self.neighbours:
             if v.value is None:
-                v.valid_values.discard(value)
+                mask = v.valid_values & keep
+                v.valid_values = mask
 
-                if len(v.valid_values) == 1:
+                if mask and mask & (mask - 1) == 0:
                     next_assign = v
 
         return next_assign
 
-    def change(self, value: int) -> bool:
-        """Return whether this entry can be changed/assigned with the given <value>.
-
-        If True, then change the entry's value and valid_values and mutate the valid_values
-        of all its neighbours accordingly. Otherwise, do nothing and return False.
-        """
-        if any(u.value == value for u in self.neighbours if u.value is not None):
-            return False
-
-        if self.value is None:
-            if value in self.valid_values:
-                self.assign(value)
-                return True
-            else:
-                return False
-
-        for v in self.neighbours:
-            if v.value is None:
-                if all(self.value != u.value for u in v.neighbours if u is not self):
-                    v.valid_values.add(self.value)
-                v.valid_values.discard(value)
-        self.value = value
-        return True
-
-    def clear(self) -> None:
-        """Set the value of this entry to None and re-calculate the valid_values based on the
-        values of its neighbours. In addition, mutate the valid_value of its neighbours"""
-        if self.value is not None:
-            self.valid_values = {1, 2, 3, 4, 5, 6, 7, 8, 9}
-
-            for v in self.neighbours:
-                if v.value is None:
-                    if all(self.value != u.value for u in v.neighbours if u is not self):
-                        v.valid_values.add(self.value)
-                else:
-                    self.valid_values.discard(v.value)
-            self.value = None
-
 
 class KillerSudoku(Sudoku):
     """A Killer Sudoku puzzle.
@@ -427,15 +642,25 @@ class KillerSudoku(Sudoku):
 
     def __init__(self) -> None:
         """Initialize a Killer Sudoku puzzle."""
-        # self._entries = {}
-        #
-        # for y in range(1, 10):
-        #     for x in range(1, 10):
-        #         self._connect_entries(x, y, _KilVertex)
-        #
+        # self._build_entries(_KilVertex)
         # self.cages = []
         self.generate('killer_sudoku.pkl')
 
+    def _index_entries(self) -> None:
+        """Build the flat entry list, then mark which cages have all their entries
+        as mutual neighbours for update_cage_valid_values."""
+        super()._index_entries()
+        self._mark_mutual_cages()
+
+    def _mark_mutual_cages(self) -> None:
+        """Set the cage_mutual flag of every entry: whether all entries of its cage
+        are neighbours of each other, so that their values must all be distinct and
+        the cage can be propagated with the precomputed value combinations."""
+        for entry in self._entries_list:
+            group = set(entry.cage_entries)
+            group.add(entry)
+            entry.cage_mutual = all(group <= m.neighbours | {m} for m in group)
+
     def generate_puzzle(self) -> list[Union[dict[tuple[int, int], _KilVertex], list[Cage]]]:
         """Generate and return a new Sudoku puzzle to store in a file as dataset.
 
@@ -452,6 +677,7 @@ class KillerSudoku(Sudoku):
 
         cla_puzzle = classic_sudoku.generate_puzzle()
         classic_sudoku._entries = cla_puzzle
+        classic_sudoku._index_entries()
         classic_sudoku.solve()
 
         for cage in self.cages:
@@ -459,10 +685,10 @@ class KillerSudoku(Sudoku):
 
         self._connect_cages()
 
-        assert all(entry.valid_values != set() for entry in self._entries.values())
+        assert all(entry.valid_values for entry in self._entries_list)
 
-        entries = copy.deepcopy(self._entries)
-        cages = copy.deepcopy(self.cages)
+        entries = self._clone_entries()
+        cages = [Cage(cage.sum, list(cage.coordinates)) for cage in self.cages]
 
         self.clear()
 
@@ -475,7 +701,7 @@ class KillerSudoku(Sudoku):
         will be chosen while making sure that the entries that are not yet in a
         cage are connected.
         """
-        no_cage = list(self._entries.keys())
+        no_cage = set(self._entries.keys())
 
         attempt = 0
         while len(no_cage) != 0:
@@ -492,7 +718,7 @@ class KillerSudoku(Sudoku):
             num_attempt = 0
             while len(entries_in_cage) != length and num_attempt < max_attempts:
                 if entries_in_cage == []:
-                    new_entry = random.choice(no_cage)
+                    new_entry = random.choice(tuple(no_cage))
                     entries_in_cage = [new_entry]
                 else:
                     new_entry = random.choice(self._possible_adjacent(entries_in_cage, no_cage))
@@ -500,16 +726,16 @@ class KillerSudoku(Sudoku):
 
                 no_cage.remove(new_entry)
 
-                if len(no_cage) != 0 and not self._connected(no_cage[0], no_cage, set()):
+                if len(no_cage) != 0 and not self._connected(next(iter(no_cage)), no_cage):
                     removed = entries_in_cage.pop()
-                    no_cage.append(removed)
+                    no_cage.add(removed)
 
                 num_attempt += 1
 
             if num_attempt != max_attempts:
                 self.cages.append(Cage(sum=0, coordinates=entries_in_cage))
             else:
-                no_cage.extend(entries_in_cage)
+                no_cage.update(entries_in_cage)
 
             attempt += 1
             if attempt > 400:
@@ -522,7 +748,9 @@ class KillerSudoku(Sudoku):
         Then obtain the indirect cages by finding all implicit sums between cages.
         For instance, if two cages with cage sum 20, 15 are subsets of the first row,
         then the remaining entries in the first row must have a sum of 45 - 20 - 15 = 10.
-        Thus an indirect cage with cage sum 10 is created for these entries.
+        Thus an indirect cage with cage sum 10 is created for these entries. Each cage
+        and house is an 81-bit cell mask, so the subset test per (cage, house) pair is
+        a single AND instead of a coordinate-set comparison.
 
         Finally, update the valid_values of all entries.
         """
@@ -535,31 +763,40 @@ class KillerSudoku(Sudoku):
                     entry1.cage_entries.add(entry2)
                     entry2.cage_entries.add(entry1)
 
-        for i in range(1, 10):
-            basics = [{(i, j) for j in range(1, 10)},
-                      {(j, i) for j in range(1, 10)},
-                      {((i - 1) % 3 * 3 + 1 + k1, (i - 1) // 3 * 3 + 1 + k2)
-                       for k1 in range(3) for k2 in range(3)}]
-            sums = [45, 45, 45]
-
-            for cage in self.cages:
-                cage_entries = set(cage.coordinates)
-                for k in range(len(basics)):
-                    if cage_entries.issubset(basics[k]):
-                        basics[k] = basics[k].difference(cage_entries)
-                        sums[k] -= cage.sum
-
-            for coords, cage_sum in zip(basics, sums):
-                if len(coords) != 9 and len(coords) != 0:
-                    for coord in coords:
-                        self._entries[coord].indirect_cages.append(
-                            IndirectCage(cage_sum, [self._entries[x] for x in coords]))
+        for entry in self._entries_list:
+            entry.cage_entries = tuple(entry.cage_entries)
+
+        cage_masks = [sum(1 << _entry_index(x, y) for x, y in cage.coordinates)
+                      for cage in self.cages]
+
+        for h in range(27):
+            house_mask = HOUSE_MASK[h]
+            house_sum = 45
+
+            for cage_mask, cage in zip(cage_masks, self.cages):
+                if cage_mask & house_mask == cage_mask:
+                    house_mask ^= cage_mask
+                    house_sum -= cage.sum
+
+            if house_mask != HOUSE_MASK[h] and house_mask != 0:
+                members = []
+                mask = house_mask
+                while mask:
+                    bit = mask & -mask
+                    mask ^= bit
+                    members.append(self._entries_list[bit.bit_length() - 1])
+
+                indirect_cage = IndirectCage(house_sum, members)
+                for entry in members:
+                    entry.indirect_cages.append(indirect_cage)
+
+        self._mark_mutual_cages()
 
         for entry in self._entries.values():
             entry.update_valid_values()
 
     def _possible_adjacent(self, entries_in_cage: list[tuple[int, int]],
-                           no_cage: list[tuple[int, int]]) -> list[tuple[int, int]]:
+                           no_cage: set[tuple[int, int]]) -> list[tuple[int, int]]:
         """Return a list of coordinates that are adjacent to entries in <entries_in_cage>
         and are in no_cage."""
         possible_adjacents = []
@@ -571,39 +808,62 @@ class KillerSudoku(Sudoku):
                     possible_adjacents.append(coord)
         return possible_adjacents
 
-    def _connected(self, coordinate: tuple[int, int], no_cage: list[tuple[int, int]],
-                   visited: set[tuple[int, int]]) -> bool:
-        """Return whether the entries in no_cage are connected or not."""
-        x, y = coordinate
-        valid_coords = []
-        possible_adjacent = [(x, y - 1), (x + 1, y), (x, y + 1), (x - 1, y)]
-        for coord in possible_adjacent:
-            if coord in no_cage and coord not in visited:
-                visited.add(coord)
-                valid_coords.append(coord)
-        visited.add(coordinate)
-
-        for coord in valid_coords:
-            self._connected(coord, no_cage, visited)
-
-        if len(visited) == len(no_cage):
-            return True
-
-        return False
+    def _connected(self, coordinate: tuple[int, int],
+                   no_cage: set[tuple[int, int]]) -> bool:
+        """Return whether the entries in no_cage are connected or not, by a breadth-first
+        search over grid adjacency starting from the given coordinate in no_cage."""
+        visited = {coordinate}
+        queue = deque([coordinate])
+        target = len(no_cage)
+
+        while queue:
+            x, y = queue.popleft()
+            for coord in ((x, y - 1), (x + 1, y), (x, y + 1), (x - 1, y)):
+                if coord in no_cage and coord not in visited:
+                    visited.add(coord)
+                    if len(visited) == target:
+                        return True
+                    queue.append(coord)
+
+        return len(visited) == target
+
+    def _clone_entries(self) -> dict[tuple[int, int], _KilVertex]:
+        """Return a new entry graph holding the values, candidate masks, and cage
+        structure of this puzzle, sharing no vertices with it. Like
+        ClassicSudoku._clone_puzzle, this replaces a deep copy of the
+        interconnected vertices; the cage attributes are remapped through an
+        old-to-new vertex mapping, keeping shared IndirectCage instances shared."""
+        clone = KillerSudoku.__new__(KillerSudoku)
+        clone._build_entries(_KilVertex)
+        mapping = dict(zip(self._entries_list, clone._entries_list))
+
+        indirect_copies = {}
+        for old, new in mapping.items():
+            new.value, new.valid_values = old.value, old.valid_values
+            new.cage_sum = old.cage_sum
+            new.cage_mutual = old.cage_mutual
+            new.cage_entries = tuple(mapping[m] for m in old.cage_entries)
+            for indirect_cage in old.indirect_cages:
+                if id(indirect_cage) not in indirect_copies:
+                    indirect_copies[id(indirect_cage)] = IndirectCage(
+                        indirect_cage.sum, [mapping[m] for m in indirect_cage.entries])
+                new.indirect_cages.append(indirect_copies[id(indirect_cage)])
+
+        return clone._entries
 
     def generate(self, filename: str) -> None:
         """Take a random puzzle from the previously generated puzzle file and assign
         it to self._entries and self.cages."""
-        with open(filename, 'rb') as file:
-            entries_and_cages = random.choice(pickle.load(file))
-            self._entries = entries_and_cages[0]
-            self.cages = entries_and_cages[1]
+        entries_and_cages = pickle.loads(random.choice(_load_dataset(filename)))
+        self._entries = entries_and_cages[0]
+        self.cages = entries_and_cages[1]
+        self._index_entries()
 
     def clear(self) -> None:
         """Clear the value of all entries, all cage sum, and all direct and indirect
         cage in the puzzle."""
         for entry in self._entries.values():
-            entry.value, entry.valid_values = None, {1, 2, 3, 4, 5, 6, 7, 8, 9}
+            entry.value, entry.valid_values = None, ALL_VALUES
             entry.cage_sum, entry.cage_entries, entry.indirect_cages = 0, set(), []
 
         self.cages = []
@@ -613,18 +873,23 @@ class _KilVertex(_Vertex):
     """An entry in a Sudoku game represented using a vertex.
 
     Public attributes:
-        - neighbours: a set containing all entries in the Sudoku game that relates to
-        this entry. Namely, the entry that is on the same row, column, and 3 x 3 grid.
-        - cage_entries: a set of entries in the same cage.
+        - neighbours: a frozenset containing all entries in the Sudoku game that
+        relates to this entry. Namely, the entry that is on the same row, column,
+        and 3 x 3 grid.
+        - cage_entries: the entries in the same cage, as a mutable set while cages
+        are being built and frozen to a tuple once _connect_cages is done.
         - cage_sum: the sum of the cage that this entry is in
         - indirect_cages: a list of instances of IndirectCage, each representing an
         indirect cage, where IndirectCage.sum is the sum of that cage, and
         IndirectCage.entries is the set of all entries in the indirect cage.
+        - cage_mutual: whether all entries of this entry's cage are neighbours of
+        each other; set by KillerSudoku._mark_mutual_cages.
     """
-    neighbours: set[_KilVertex]
-    cage_entries: set[_KilVertex]
+    neighbours: frozenset[_KilVertex]
+    cage_entries: tuple[_KilVertex, ...]
     cage_sum: int
     indirect_cages: list[IndirectCage]
+    cage_mutual: bool
 
     def __init__(self) -> None:
         """Initialize an entry for a Killer Sudoku puzzle."""
@@ -632,6 +897,12 @@ class _KilVertex(_Vertex):
         self.cage_entries = set()
         self.cage_sum = 0
         self.indirect_cages = []
+        self.cage_mutual = True
+
+    def __setstate__(self, state: dict) -> None:
+        """Restore a pickled entry, additionally freezing the cage entries."""
+        state['cage_entries'] = tuple(state['cage_entries'])
+        super().__setstate__(state)
 
     def assign(self, value: int) -> Optional[_Vertex]:
         """Assign the given value to this entry, and set its valid values to an empty set.
@@ -645,14 +916,16 @@ class _KilVertex(_Vertex):
             - value in self.valid_values
         """
         self.value = value
-        self.valid_values = set()
+        self.valid_values = 0
 
+        keep = ~(1 << (value - 1))
         next_assign = None
         for v in self.neighbours:
             if v.value is None:
-                v.valid_values.discard(value)
+                mask = v.valid_values & keep
+                v.valid_values = mask
 
-                if len(v.valid_values) == 1:
+                if mask and mask & (mask - 1) == 0:
                     next_assign = v
 
         result = self.update_valid_values()
@@ -670,73 +943,107 @@ class _KilVertex(_Vertex):
         """
         next_assign = None
         cages = list(self.cage_entries) + [self]
-        result = self.update_cage_valid_values(cages, self.cage_sum)
+        result = self.update_cage_valid_values(cages, self.cage_sum, self.cage_mutual)
         if result is not None:
             next_assign = result
 
+        # The entries of an indirect cage all lie in a single row, column, or
+        # subgrid, so they are always mutual neighbours.
         for indirect_cage in self.indirect_cages:
-            result = self.update_cage_valid_values(indirect_cage.entries, indirect_cage.sum)
+            result = self.update_cage_valid_values(indirect_cage.entries, indirect_cage.sum,
+                                                   True)
             if result is not None:
                 next_assign = result
 
         return next_assign
 
-    def update_cage_valid_values(self, cages: list[_KilVertex], cage_sum: int) \
-            -> Optional[_KilVertex]:
+    def update_cage_valid_values(self, cages: list[_KilVertex], cage_sum: int,
+                                 mutual: bool = False) -> Optional[_KilVertex]:
         """Update the valid values of this entry and its cage neighbours.
 
+        When <mutual> is True, every entry of the cage is a neighbour of every other,
+        so the cage must be filled with distinct values and the precomputed value
+        combinations in CAGE_COMBOS replace the recursive search over the cage.
+
         Return the entry with only one valid value after the mutation, if there is any, otherwise
         return None.
         """
-        has_value = 0
-        no_value = len(cages)
-        while has_value != no_value:
-            if cages[has_value].value is not None:
-                has_value += 1
+        known = []
+        free = []
+        for entry in cages:
+            if entry.value is not None:
+                known.append(entry)
             else:
-                cages[has_value], cages[no_value - 1] = cages[no_value - 1], cages[has_value]
-                no_value -= 1
-
-        if has_value != len(cages):
-            known_values = [cages[j].value for j in range(has_value)]
-            new_valid_values = [set() for _ in range(len(cages))]
-            cages[has_value].update_cage(known_values, cages, new_valid_values, cage_sum)
+                free.append(entry)
+
+        if not free:
+            return None
+
+        has_value = len(known)
+        known_values = [entry.value for entry in known]
+        new_valid_values = [0] * len(cages)
+
+        if mutual:
+            known_mask = 0
+            for value in known_values:
+                known_mask |= 1 << (value - 1)
+
+            union = 0
+            for entry in free:
+                union |= entry.valid_values
+
+            # A combination completes the cage only if it reuses no known value,
+            # uses no value that every free entry has lost, and leaves a value
+            # for each free entry. Every value of each surviving combination is
+            # kept, which can only under-prune, never over-prune.
+            combined = 0
+            for combo in CAGE_COMBOS.get((len(free), cage_sum - sum(known_values)), ()):
+                if combo & known_mask == 0 and combo & ~union == 0 and \
+                        all(combo & entry.valid_values for entry in free):
+                    combined |= combo
+
+            for i, entry in enumerate(free):
+                new_valid_values[has_value + i] = combined & entry.valid_values
+        else:
+            free[0].update_cage(known_values, known + free, new_valid_values, cage_sum)
 
-            next_assign = None
-            for i in range(has_value, len(cages)):
-                cages[i].valid_values = cages[i].valid_values.intersection(new_valid_values[i])
-                if len(new_valid_values[i]) == 1:
-                    next_assign = cages[i]
-            return next_assign
+        next_assign = None
+        for i, entry in enumerate(free):
+            mask = entry.valid_values & new_valid_values[has_value + i]
+            entry.valid_values = mask
+            if mask and not mask & (mask - 1):
+                next_assign = entry
+        return next_assign
 
     def update_cage(self, known_values: list[int], cages: list[_KilVertex], new_valid_values:
-                    list[set[int]], cage_sum: int) -> bool:
+                    list[int], cage_sum: int) -> bool:
         """Update the valid values of all entries in the cage. A valid value is added to one of
         the new_valid_values if it appears in a combination whose sum equals the given cage_sum
         and that there is no two entries in this cage have the same value if they are neighbours
         of each other."""
         if len(known_values) == len(cages) - 1:
             valid_value = cage_sum - sum(known_values)
-            if valid_value not in self.valid_values:
+            if valid_value < 1 or valid_value > 9 or \
+                    not self.valid_values & (1 << (valid_value - 1)):
                 return False
 
             for j in range(len(known_values)):
                 if cages[j] in self.neighbours and valid_value == known_values[j]:
                     return False
 
-            new_valid_values[len(known_values)].add(valid_value)
+            new_valid_values[len(known_values)] |= 1 << (valid_value - 1)
             return True
 
         next_entry = cages[len(known_values) + 1]
         result = False
-        for valid_value in self.valid_values:
+        for valid_value in _mask_to_values(self.valid_values):
             if valid_value + sum(known_values) < cage_sum and all(cages[i] not in self.neighbours
                                                                   or valid_value != known_values[i]
                                                                   for i in
                                                                   range(len(known_values))):
                 if next_entry.update_cage(known_values + [valid_value], cages, new_valid_values,
                                           cage_sum):
-                    new_valid_values[len(known_values)].add(valid_value)
+                    new_valid_values[len(known_values)] |= 1 << (valid_value - 1)
                     result = True
 
         return result
@@ -789,7 +1096,8 @@ if __name__ == '__main__':
     python_ta.check_all()
 
     python_ta.check_all(config={
-        'extra-imports': ['pickle', 'random', 'copy', 'pprint'],
+        'extra-imports': ['pickle', 'random', 'pprint', 'collections', 'struct',
+                          'solver_core'],
         'allowed-io': ['solve', 'print_puzzle', 'generate_puzzle', 'generate', 'sudoku_dataset'],
         'max-line-length': 100,
         'disable': ['E1136'],